@@ -1,9 +1,6 @@
 """Main application for Jeep Patriot diagnostic assistant."""
 
 import os
-# Disable ChromaDB telemetry to prevent errors
-os.environ["ANONYMIZED_TELEMETRY"] = "False"
-
 import logging
 from dotenv import load_dotenv
 from patriot_agent import PatriotAgent
@@ -61,10 +58,14 @@ def main():
             print("\n🔍 Analyzing issue and consulting manual...")
             
             try:
-                diagnosis = agent.diagnose(user_input)
                 print("\n📋 DIAGNOSTIC RESPONSE:")
                 print("-" * 40)
-                print(diagnosis)
+                diagnosis = agent.diagnose(user_input)
+                if agent.stream_output:
+                    # Tokens were already streamed to stdout by the agent
+                    print()
+                else:
+                    print(diagnosis)
                 print("-" * 40 + "\n")
                 
             except Exception as e:
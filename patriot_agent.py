@@ -1,74 +1,193 @@
 """LangGraph workflow for Jeep Patriot diagnostic assistant."""
 
+import asyncio
+import os
+import re
 from typing import Dict, Any, List, TypedDict
+
+import numpy as np
+import tiktoken
 from langgraph.graph import StateGraph, END
 from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
 from semantic_pdf_reader import SemanticPatriotManualReader
+from pdf_reader import PatriotManualReader
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Cached responses are reused for queries at least this similar (cosine)
+QCACHE_SIMILARITY_THRESHOLD = 0.97
+QCACHE_MAX_ENTRIES = 256
+
+# Terms that trigger expanded searches for vague queries
+AUTOMOTIVE_TERMS = frozenset({"diagnostic", "troubleshoot", "symptom", "repair", "maintenance"})
+
+# Manual context sent to the diagnosis LLM is capped at this many tokens
+MANUAL_CONTEXT_TOKEN_BUDGET = 1500
+
+_encoder = None
+
+def _get_encoder():
+    """Lazily load (and cache) the tokenizer used for prompt budgeting."""
+    global _encoder
+    if _encoder is None:
+        _encoder = tiktoken.encoding_for_model("gpt-4o-mini")
+    return _encoder
+
 class PatriotDiagnosticState(TypedDict):
     """State management for the diagnostic workflow."""
     user_query: str
+    query_embedding: List[float]
     relevant_sections: List[str]
     diagnosis: str
+    diagnosis_success: bool
     recommendations: List[str]
     conversation_history: List[Dict]
 
 class PatriotAgent:
     """Main agent for Jeep Patriot diagnostics using LangGraph."""
     
-    def __init__(self, pdf_path: str):
+    def __init__(self, pdf_path: str, stream_output: bool = True):
         self.pdf_reader = SemanticPatriotManualReader(pdf_path)
+        self.stream_output = stream_output
+        self.keyword_reader = PatriotManualReader(pdf_path)
         self.llm = ChatOpenAI(
             model="gpt-4o-mini",
             temperature=0.1
         )
+        
+        # Load and index the manual once at startup; re-running this on every
+        # diagnose() call re-indexed the manual per user turn
+        if not self.pdf_reader.load_and_index_manual():
+            raise RuntimeError("Failed to load and index the Jeep Patriot manual")
+        logger.info("Successfully loaded and indexed manual")
+        
         self.workflow = self._build_workflow()
         
+        # One long-lived event loop for all turns: per-call asyncio.run would
+        # close the loop the OpenAI client's pooled connections were opened
+        # under, breaking ainvoke/astream on subsequent turns
+        self._loop = asyncio.new_event_loop()
+        
+        # Semantic response cache: query embedding -> past diagnosis
+        self._qcache_path = os.path.join(self.pdf_reader.persist_directory, "qcache.npz")
+        self._qcache = self._load_qcache()
+        
+        # Embeddings for the search-expansion terms, filled lazily so the
+        # expansion loop never re-embeds the same term twice
+        self._term_vectors: Dict[str, np.ndarray] = {}
+        
+        self._warm_up()
+        
+    def _warm_up(self) -> None:
+        """Warm the OpenAI connection pool and the embedding model.
+        
+        Without this the user's first turn pays the TLS handshake for the
+        chat endpoint and the load of the sentence-transformer model; a
+        one-token ping moves both costs to startup. The ping goes through
+        ainvoke on the agent's loop because that is the async client pool
+        the workflow nodes actually use at turn time.
+        """
+        try:
+            self.pdf_reader.embed_query("init")
+            self._loop.run_until_complete(
+                self.llm.ainvoke([HumanMessage(content="ping")], max_tokens=1)
+            )
+            logger.info("Warmed up LLM connection and embedding model")
+        except Exception as e:
+            logger.error(f"Error during warm-up: {e}")
+    
     def _build_workflow(self) -> StateGraph:
         """Build the LangGraph workflow."""
         workflow = StateGraph(PatriotDiagnosticState)
         
         # Add nodes
-        workflow.add_node("read_manual", self._read_manual_node)
-        workflow.add_node("analyze_query", self._analyze_query_node)
-        workflow.add_node("search_manual", self._search_manual_node)
+        workflow.add_node("analyze_and_search", self._analyze_and_search_node)
         workflow.add_node("generate_diagnosis", self._generate_diagnosis_node)
-        workflow.add_node("format_response", self._format_response_node)
-        
+
         # Define the flow
-        workflow.set_entry_point("read_manual")
-        workflow.add_edge("read_manual", "analyze_query")
-        workflow.add_edge("analyze_query", "search_manual")
-        workflow.add_edge("search_manual", "generate_diagnosis")
-        workflow.add_edge("generate_diagnosis", "format_response")
-        workflow.add_edge("format_response", END)
+        workflow.set_entry_point("analyze_and_search")
+        workflow.add_edge("analyze_and_search", "generate_diagnosis")
+        workflow.add_edge("generate_diagnosis", END)
         
         return workflow.compile()
     
-    def _read_manual_node(self, state: PatriotDiagnosticState) -> Dict[str, Any]:
-        """Read and process the Jeep Patriot manual."""
-        logger.info("Loading and indexing Jeep Patriot manual...")
+    def _load_qcache(self) -> List:
+        """Load the persisted semantic response cache, if any.
         
+        Like the vector index, the cache is only valid for the embedding
+        model it was built with; a model change alters vector dimensions.
+        """
         try:
-            # Load and index the manual for semantic search
-            success = self.pdf_reader.load_and_index_manual()
-            if success:
-                logger.info("Successfully loaded and indexed manual")
-            else:
-                logger.error("Failed to load and index manual")
+            if os.path.exists(self._qcache_path):
+                data = np.load(self._qcache_path, allow_pickle=True)
+                model = str(data["model"]) if "model" in data.files else None
+                if model != self.pdf_reader.embedding_model_name:
+                    logger.info("Discarding response cache built with a different embedding model")
+                    return []
+                cache = list(zip(list(data["vectors"]), list(data["diagnoses"])))
+                logger.info(f"Loaded {len(cache)} cached responses")
+                return cache
+        except Exception as e:
+            logger.error(f"Error loading response cache: {e}")
+        return []
+    
+    def _save_qcache(self) -> None:
+        """Persist the semantic response cache next to the vector store."""
+        try:
+            os.makedirs(os.path.dirname(self._qcache_path), exist_ok=True)
+            np.savez(
+                self._qcache_path,
+                vectors=np.stack([vec for vec, _ in self._qcache]),
+                diagnoses=np.array([diag for _, diag in self._qcache], dtype=object),
+                model=np.array(self.pdf_reader.embedding_model_name)
+            )
         except Exception as e:
-            logger.error(f"Error reading manual: {e}")
+            logger.error(f"Error saving response cache: {e}")
+    
+    def _cache_lookup(self, query: str):
+        """Embed the query and return (embedding, cached diagnosis or None)."""
+        try:
+            query_vector = np.asarray(self.pdf_reader.embeddings.embed_query(query), dtype=np.float32)
+            query_vector /= np.linalg.norm(query_vector)
+        except Exception as e:
+            logger.error(f"Error embedding query for response cache: {e}")
+            return None, None
         
-        return state
+        if self._qcache:
+            try:
+                sims = np.stack([vec for vec, _ in self._qcache]) @ query_vector
+            except ValueError as e:
+                # Cached vectors don't match the current embedding dimension
+                logger.error(f"Discarding incompatible response cache: {e}")
+                self._qcache = []
+                return query_vector, None
+            best = int(np.argmax(sims))
+            if sims[best] >= QCACHE_SIMILARITY_THRESHOLD:
+                logger.info(f"Response cache hit (similarity {sims[best]:.3f})")
+                return query_vector, self._qcache[best][1]
+        
+        return query_vector, None
     
-    def _analyze_query_node(self, state: PatriotDiagnosticState) -> Dict[str, Any]:
-        """Analyze user query to understand the issue."""
-        logger.info("Analyzing user query...")
+    async def _initial_vector_search(self, state: PatriotDiagnosticState) -> List[str]:
+        """Search the manual by vector, embedding the query at most once.
         
+        The response-cache lookup already embedded the query, so the normal
+        path reuses that vector and makes no embedding API call at all.
+        """
+        if state.get("query_embedding") is None:
+            state["query_embedding"] = await self.pdf_reader.aembed_query(state["user_query"])
+        return await self.pdf_reader.asemantic_search_by_vector(state["query_embedding"], k=8)
+    
+    async def _analyze_and_search_node(self, state: PatriotDiagnosticState) -> Dict[str, Any]:
+        """Analyze the user query and search the manual concurrently.
+
+        The query analysis LLM call is independent of the semantic search, so
+        both network-bound calls are overlapped with asyncio.gather.
+        """
+        logger.info("Analyzing query and searching manual concurrently...")
+
         analysis_prompt = f"""
         Analyze this Jeep Patriot related query: "{state['user_query']}"
         
@@ -84,59 +203,124 @@ class PatriotAgent:
             "focus_areas": ["area1", "area2"]
         }}
         """
-        
-        try:
-            response = self.llm.invoke([
+
+        analysis_response, search_results = await asyncio.gather(
+            self.llm.ainvoke([
                 SystemMessage(content="You are an expert automotive diagnostic assistant specializing in Jeep Patriots."),
                 HumanMessage(content=analysis_prompt)
-            ])
-            
-            logger.info(f"Query analysis response: {response.content}")
-            
+            ]),
+            self._initial_vector_search(state),
+            return_exceptions=True
+        )
+
+        if isinstance(analysis_response, Exception):
+            logger.error(f"Error analyzing query: {analysis_response}")
+        else:
+            logger.info(f"Query analysis response: {analysis_response.content}")
+
             # Store the analysis
             if "conversation_history" not in state:
                 state["conversation_history"] = []
             state["conversation_history"].append({
                 "type": "analysis",
-                "content": response.content
+                "content": analysis_response.content
             })
-            
-        except Exception as e:
-            logger.error(f"Error analyzing query: {e}")
-        
-        return state
-    
-    def _search_manual_node(self, state: PatriotDiagnosticState) -> Dict[str, Any]:
-        """Search manual for relevant information using semantic search."""
-        logger.info("Performing semantic search on manual...")
-        
-        # Perform semantic search on the user query
-        search_results = self.pdf_reader.semantic_search(state["user_query"], k=8)
+
+        if isinstance(search_results, Exception):
+            logger.error(f"Error during semantic search: {search_results}")
+            search_results = []
         logger.info(f"Initial search for '{state['user_query']}' returned {len(search_results)} results")
-        
+
         # Also try related automotive terms if the query is vague
-        if len(search_results) < 3:
-            automotive_terms = ["diagnostic", "troubleshoot", "symptom", "repair", "maintenance"]
-            for term in automotive_terms:
-                if term.lower() in state["user_query"].lower():
-                    expanded_query = f"{term} {state['user_query']}"
-                    logger.info(f"Expanding search with: '{expanded_query}'")
-                    additional_results = self.pdf_reader.semantic_search(expanded_query, k=3)
-                    search_results.extend(additional_results)
-        
-        state["relevant_sections"] = search_results[:10]  # Limit total results
+        if len(search_results) < 3 and state.get("query_embedding") is not None:
+            # Lowercase and tokenize the query once; a set intersection finds
+            # every matching term without per-term substring scans
+            query_tokens = set(re.findall(r"[a-z]+", state["user_query"].lower()))
+            matched_terms = sorted(query_tokens & AUTOMOTIVE_TERMS)
+
+            if matched_terms:
+                # Embed each term at most once per process, then blend with
+                # the query vector locally - the expansion loop makes no
+                # embedding API calls
+                missing = [term for term in matched_terms if term not in self._term_vectors]
+                if missing:
+                    try:
+                        term_vectors = await self.pdf_reader.embeddings.aembed_documents(missing)
+                        for term, vector in zip(missing, term_vectors):
+                            self._term_vectors[term] = np.asarray(vector, dtype=np.float32)
+                    except Exception as e:
+                        logger.error(f"Error embedding automotive terms: {e}")
+
+                base_vector = np.asarray(state["query_embedding"], dtype=np.float32)
+                expanded_vectors = []
+                for term in matched_terms:
+                    if term in self._term_vectors:
+                        logger.info(f"Expanding search with blended vector for: '{term}'")
+                        expanded_vectors.append((0.5 * (base_vector + self._term_vectors[term])).tolist())
+
+                if expanded_vectors:
+                    # The expanded searches are independent, so overlap them too
+                    additional = await asyncio.gather(*[
+                        self.pdf_reader.asemantic_search_by_vector(vector, k=3)
+                        for vector in expanded_vectors
+                    ])
+                    for additional_results in additional:
+                        search_results.extend(additional_results)
+
+        # Fall back to plain keyword search if semantic search found nothing
+        if not search_results:
+            logger.info("Semantic search returned no results, falling back to keyword search")
+            search_results = self.keyword_reader.search_manual(state["user_query"])
+
+        # Expanded searches often return the same top chunks; drop duplicates
+        # before trimming so they don't inflate the diagnosis prompt
+        seen = set()
+        unique_results = [
+            section for section in search_results
+            if not (section in seen or seen.add(section))
+        ]
+
+        state["relevant_sections"] = unique_results[:10]  # Limit total results
         logger.info(f"Found {len(state['relevant_sections'])} relevant manual sections")
-        
+
         # Log the RAG context being sent to LLM for debugging
         if state["relevant_sections"]:
             logger.info("RAG context preview:")
             for i, section in enumerate(state["relevant_sections"][:3]):  # Log first 3 sections
                 preview = section[:200] + "..." if len(section) > 200 else section
                 logger.info(f"  Section {i+1}: {preview}")
-        
+
         return state
     
-    def _generate_diagnosis_node(self, state: PatriotDiagnosticState) -> Dict[str, Any]:
+    def _pack_context(self, sections: List[str], budget: int = MANUAL_CONTEXT_TOKEN_BUDGET) -> List[str]:
+        """Greedily pack the highest-ranked sections into a token budget.
+        
+        LLM latency and cost scale with input tokens, and an oversized
+        context can drown the relevant chunk in noise.
+        """
+        try:
+            encoder = _get_encoder()
+        except Exception as e:
+            logger.error(f"Error loading tokenizer, skipping context trim: {e}")
+            return sections
+        
+        packed = []
+        used = 0
+        for section in sections:
+            tokens = len(encoder.encode(section))
+            if used + tokens > budget:
+                break
+            packed.append(section)
+            used += tokens
+        
+        # Always keep the top-ranked section, even if it alone is oversized
+        if not packed and sections:
+            packed = sections[:1]
+        
+        logger.info(f"Packed {len(packed)}/{len(sections)} sections (~{used} tokens) into context")
+        return packed
+    
+    async def _generate_diagnosis_node(self, state: PatriotDiagnosticState) -> Dict[str, Any]:
         """Generate diagnosis based on manual content and query."""
         logger.info("Generating diagnosis...")
         
@@ -153,9 +337,11 @@ I can only provide diagnostic assistance based on the official manual content. P
 - Maintenance procedures
 
 Or describe specific symptoms you're experiencing with your Patriot."""
+            if self.stream_output:
+                print(state["diagnosis"], end="", flush=True)
             return state
         
-        manual_context = "\n\n".join(state["relevant_sections"])
+        manual_context = "\n\n".join(self._pack_context(state["relevant_sections"]))
         
         diagnosis_prompt = f"""
         Based ONLY on the Jeep Patriot manual content below, provide a diagnostic response for this query:
@@ -188,39 +374,63 @@ Or describe specific symptoms you're experiencing with your Patriot."""
             logger.info(f"Sending diagnosis prompt to LLM (length: {len(diagnosis_prompt)} chars)")
             logger.debug(f"Full diagnosis prompt: {diagnosis_prompt}")
             
-            response = self.llm.invoke(messages)
+            if self.stream_output:
+                # Forward tokens to stdout as they arrive so the user sees
+                # output at time-to-first-token instead of after the full
+                # completion lands
+                chunks = []
+                async for chunk in self.llm.astream(messages):
+                    chunks.append(chunk.content)
+                    print(chunk.content, end="", flush=True)
+                content = "".join(chunks)
+            else:
+                response = await self.llm.ainvoke(messages)
+                content = response.content
             
-            logger.info(f"LLM diagnosis response (length: {len(response.content)} chars)")
-            logger.debug(f"Full LLM response: {response.content}")
+            logger.info(f"LLM diagnosis response (length: {len(content)} chars)")
+            logger.debug(f"Full LLM response: {content}")
             
-            state["diagnosis"] = response.content
+            state["diagnosis"] = content
+            state["diagnosis_success"] = True
             
         except Exception as e:
             logger.error(f"Error generating diagnosis: {e}")
             state["diagnosis"] = "I apologize, but I encountered an error while analyzing the manual content. Please try again."
-        
-        return state
-    
-    def _format_response_node(self, state: PatriotDiagnosticState) -> Dict[str, Any]:
-        """Format the final response."""
-        logger.info("Formatting response...")
-        
-        # The diagnosis is already well-formatted from the LLM
-        # Add any additional formatting if needed
+            if self.stream_output:
+                print(state["diagnosis"], end="", flush=True)
         
         return state
     
     def diagnose(self, user_query: str) -> str:
         """Main method to diagnose Jeep Patriot issues."""
+        # Paraphrases of recent questions are answered straight from the
+        # semantic response cache without touching the full pipeline
+        query_vector, cached = self._cache_lookup(user_query)
+        if cached is not None:
+            if self.stream_output:
+                print(cached, end="", flush=True)
+            return cached
+        
         state = {
             "user_query": user_query,
+            "query_embedding": query_vector.tolist() if query_vector is not None else None,
             "relevant_sections": [],
             "diagnosis": "",
+            "diagnosis_success": False,
             "recommendations": [],
             "conversation_history": []
         }
         
-        # Run the workflow
-        final_state = self.workflow.invoke(state)
+        # Run the workflow (async nodes overlap their network calls)
+        final_state = self._loop.run_until_complete(self.workflow.ainvoke(state))
+        diagnosis = final_state["diagnosis"]
+        
+        # Only successful diagnoses are cached; fallback and error messages
+        # must not become sticky answers for a query
+        if query_vector is not None and diagnosis and final_state.get("diagnosis_success"):
+            self._qcache.append((query_vector, diagnosis))
+            if len(self._qcache) > QCACHE_MAX_ENTRIES:
+                self._qcache.pop(0)
+            self._save_qcache()
         
-        return final_state["diagnosis"]
+        return diagnosis
@@ -0,0 +1,160 @@
+"""Keyword-based PDF reader for the Jeep Patriot manual."""
+
+import logging
+import mmap
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from pypdf import PdfReader
+
+# Prefer the native pdfium backend for extraction; fall back to pure-Python
+# pypdf when it isn't installed
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+logger = logging.getLogger(__name__)
+
+# One compiled pattern classifies a line into a topic section; the named
+# group that matched gives the section key directly
+_SECTION_RE = re.compile(
+    r"(?P<maintenance>maintenance|service)"
+    r"|(?P<troubleshooting>troubleshoot|problem|diagnostic)"
+    r"|(?P<engine>engine)"
+    r"|(?P<transmission>transmission)"
+    r"|(?P<electrical>electrical|fuse)"
+    r"|(?P<brakes>brake)",
+    re.IGNORECASE
+)
+
+def _extract_page(args: Tuple[str, int]) -> Tuple[int, str]:
+    """Extract text from a single page (runs in a worker process)."""
+    pdf_path, page_index = args
+    if pdfium is not None:
+        pdf = pdfium.PdfDocument(pdf_path)
+        return page_index, pdf[page_index].get_textpage().get_text_range()
+    # pypdf seeks randomly through xref tables and page objects; a memory
+    # map serves those seeks from the OS page cache without read syscalls
+    with open(pdf_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return page_index, PdfReader(mm).pages[page_index].extract_text()
+
+class PatriotManualReader:
+    """Keyword search-enabled plain-text reader for the Jeep Patriot manual."""
+
+    def __init__(self, pdf_path: str):
+        self.pdf_path = pdf_path
+        self.manual_content: Dict[str, str] = {}
+        # The manual PDF is immutable for the process lifetime, so cache the
+        # extracted text and parse the PDF at most once.
+        self._full_text = None
+        self._lines = None
+        self._lines_lower = None
+        self._index = None
+
+    def extract_text(self) -> str:
+        """Extract the full manual text, parsing the PDF only on first call."""
+        if self._full_text is not None:
+            return self._full_text
+
+        try:
+            logger.info("Extracting text from manual PDF...")
+            # Count pages with pypdf here: pdfium is not fork-safe, so it
+            # must only ever run inside the spawned workers
+            with open(self.pdf_path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    n_pages = len(PdfReader(mm).pages)
+
+            # Pages are independent, so farm the CPU-bound per-page
+            # extraction out to worker processes; spawned (not forked)
+            # workers get a fresh pdfium library state
+            with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as executor:
+                results = list(executor.map(
+                    _extract_page,
+                    [(self.pdf_path, i) for i in range(n_pages)],
+                    chunksize=8
+                ))
+
+            results.sort()
+            self._full_text = "".join(text for _, text in results)
+            self._lines = self._full_text.split("\n")
+            logger.info(f"Extracted {len(self._lines)} lines from manual")
+
+        except Exception as e:
+            logger.error(f"Error extracting text from PDF: {e}")
+            self._full_text = ""
+            self._lines = []
+
+        self._build_index()
+        return self._full_text
+
+    def _build_index(self) -> None:
+        """Build a token -> line-number inverted index over the manual text."""
+        self._lines_lower = [line.lower() for line in self._lines]
+
+        index: Dict[str, List[int]] = {}
+        for i, line_lower in enumerate(self._lines_lower):
+            for token in set(re.findall(r"[a-z0-9]+", line_lower)):
+                index.setdefault(token, []).append(i)
+
+        self._index = index
+        logger.info(f"Built inverted index with {len(index)} tokens")
+
+    def search_manual(self, query: str, context_lines: int = 2) -> List[str]:
+        """Search the manual for lines containing the query."""
+        self.extract_text()
+
+        query_lower = query.lower()
+        q_tokens = re.findall(r"[a-z0-9]+", query_lower)
+        if not q_tokens:
+            return []
+
+        # Intersect posting lists so only lines containing every query token
+        # are considered, instead of scanning the whole manual per query
+        candidates = set(self._index.get(q_tokens[0], []))
+        for token in q_tokens[1:]:
+            candidates &= set(self._index.get(token, []))
+
+        results = []
+        for i in sorted(candidates):
+            # Multi-word queries keep the original exact-phrase semantics
+            if len(q_tokens) > 1 and query_lower not in self._lines_lower[i]:
+                continue
+            start = max(0, i - context_lines)
+            end = min(len(self._lines), i + context_lines + 1)
+            results.append("\n".join(self._lines[start:end]))
+
+        logger.info(f"Found {len(results)} keyword matches for query: '{query}'")
+        return results
+
+    def extract_sections(self) -> Dict[str, str]:
+        """Split the cached manual text into coarse topic sections."""
+        self.extract_text()
+
+        section_names = [
+            "maintenance",
+            "troubleshooting",
+            "engine",
+            "transmission",
+            "electrical",
+            "brakes",
+            "general",
+        ]
+
+        # Accumulate lines in per-section lists; repeated string += on dict
+        # values copies the whole section on every line
+        buffers = {name: [] for name in section_names}
+        current_section = "general"
+        for line in self._lines:
+            match = _SECTION_RE.search(line)
+            if match:
+                current_section = match.lastgroup
+
+            buffers[current_section].append(line)
+
+        sections = {name: "\n".join(lines) for name, lines in buffers.items()}
+        self.manual_content = sections
+        return sections